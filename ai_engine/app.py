@@ -1,6 +1,10 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from fastapi.responses import Response
+from sqlalchemy import func, case, select
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
+import functools
 import tempfile
 import os
 import logging
@@ -8,15 +12,24 @@ import time
 import sys
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Add parent directory to path for imports
 parent_dir = str(Path(__file__).parent.parent)
 if parent_dir not in sys.path:
     sys.path.insert(0, parent_dir)
 
-from model_loader import load_model
-from inference import analyze_video_with_gradcam
-from database.database import get_db, VideoAnalysis, BlockchainLog, init_db
-from video_hash import compute_video_hash, get_file_size
+from model_worker import ModelWorker
+from database.database import (
+    get_db, SessionLocal, VideoAnalysis, BlockchainLog, init_db, insert_video_analysis,
+    is_hex_digest
+)
+from video_hash import (
+    FileDigest, new_video_hasher, HASH_CHUNK_SIZE
+)
 from blockchain.blockchain_service import get_blockchain_service
 
 # Logging setup
@@ -34,15 +47,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize database on startup
+# Model runs in its own process (owns the CUDA context); requests hand it
+# temp file paths so inference never blocks the event loop
+model_worker = ModelWorker()
+blockchain_service = get_blockchain_service()
+
+# Initialize database and model worker on startup
 @app.on_event("startup")
 async def startup_event():
-    init_db()
+    await init_db()
     logger.info("✅ Database initialized")
+    
+    await asyncio.get_running_loop().run_in_executor(None, model_worker.start)
+    logger.info("✅ Model worker ready")
 
-# Load model
-model = load_model()
-blockchain_service = get_blockchain_service()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    model_worker.stop()
 
 ALLOWED_VIDEO_TYPES = {
     "video/mp4", "video/mpeg", "video/quicktime", 
@@ -54,27 +76,34 @@ MAX_FILE_SIZE = 500 * 1024 * 1024  # 500MB
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
+    # An RPC round trip (with retries); kept off the event loop
+    blockchain_connected = await asyncio.get_running_loop().run_in_executor(
+        None, blockchain_service.is_connected
+    )
     return {
         "status": "ok",
-        "model": "loaded",
-        "blockchain_connected": blockchain_service.is_connected(),
+        "model": "loaded" if model_worker.is_alive() else "unavailable",
+        "blockchain_connected": blockchain_connected,
         "database": "connected"
     }
 
 
 @app.get("/stats")
-async def get_stats(db: Session = Depends(get_db)):
+async def get_stats(db: AsyncSession = Depends(get_db)):
     """Get analysis statistics"""
-    total_analyses = db.query(VideoAnalysis).count()
-    fake_count = db.query(VideoAnalysis).filter(
-        VideoAnalysis.prediction == "FAKE"
-    ).count()
-    real_count = db.query(VideoAnalysis).filter(
-        VideoAnalysis.prediction == "REAL"
-    ).count()
-    blockchain_verified = db.query(VideoAnalysis).filter(
-        VideoAnalysis.blockchain_verified == True
-    ).count()
+    # One aggregate query instead of four separate COUNTs
+    row = (await db.execute(select(
+        func.count(VideoAnalysis.id).label("total"),
+        func.sum(case((VideoAnalysis.prediction == "FAKE", 1), else_=0)).label("fake"),
+        func.sum(case((VideoAnalysis.prediction == "REAL", 1), else_=0)).label("real"),
+        func.sum(case((VideoAnalysis.blockchain_verified == True, 1), else_=0)).label("verified")
+    ))).one()
+    
+    # SUM over an empty table is NULL
+    total_analyses = row.total
+    fake_count = row.fake or 0
+    real_count = row.real or 0
+    blockchain_verified = row.verified or 0
     
     return {
         "total_analyses": total_analyses,
@@ -85,10 +114,82 @@ async def get_stats(db: Session = Depends(get_db)):
     }
 
 
+def cached_analysis_response(filename, existing, gradcam_frames=None):
+    """Response for a video whose analysis is already stored"""
+    return {
+        "filename": filename,
+        "prediction": existing.prediction,
+        "confidence": existing.confidence,
+        "status": "success",
+        "cached": True,
+        "original_filename": existing.filename,
+        "analysis_timestamp": existing.analysis_timestamp.isoformat(),
+        "video_hash": existing.video_hash,
+        "blockchain_tx_hash": existing.blockchain_tx_hash,
+        "blockchain_url": existing.blockchain_url,
+        "blockchain_verified": existing.blockchain_verified,
+        "gradcam_frames": gradcam_frames or []  # Not stored in DB to save space
+    }
+
+
+async def submit_to_blockchain(analysis_id, digest, is_fake, confidence):
+    """
+    Log evidence to blockchain and attach the transaction to the analysis
+    
+    Runs as a background task after /predict-video has responded, so it
+    opens its own database session. The Web3 calls are blocking and run
+    in a thread.
+    """
+    db = SessionLocal()
+    
+    try:
+        logger.info(" Logging to blockchain...")
+        
+        blockchain_result = await asyncio.get_running_loop().run_in_executor(
+            None,
+            functools.partial(
+                blockchain_service.log_evidence,
+                video_hash=digest.hex,
+                is_fake=is_fake,
+                confidence=confidence
+            )
+        )
+        
+        if not blockchain_result['success']:
+            logger.error(f"❌ Blockchain error: {blockchain_result.get('error')}")
+            return
+        
+        blockchain_tx_hash = blockchain_result['tx_hash']
+        logger.info(f" Blockchain TX: {blockchain_tx_hash}")
+        
+        analysis = await db.get(VideoAnalysis, analysis_id)
+        if analysis is not None:
+            analysis.blockchain_tx_hash = blockchain_tx_hash
+            analysis.blockchain_url = blockchain_result['etherscan_url']
+        
+        # Save blockchain log
+        db.add(BlockchainLog(
+            tx_hash=blockchain_tx_hash,
+            video_hash=digest.hex,
+            is_fake=is_fake,
+            confidence=confidence,
+            status="pending"
+        ))
+        await db.commit()
+    
+    except Exception as e:
+        logger.error(f"Blockchain logging failed: {e}")
+        await db.rollback()
+    
+    finally:
+        await db.close()
+
+
 @app.post("/predict-video")
 async def predict_video(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Analyze video for deepfake detection with hash-based caching
@@ -96,8 +197,8 @@ async def predict_video(
     Flow:
     1. Compute video hash
     2. Check if already analyzed (instant result, no GPU cost)
-    3. If new: analyze, store in DB, log to blockchain
-    4. Return results with blockchain verification
+    3. If new: analyze and store in DB
+    4. Return results; blockchain logging continues in the background
     """
     
     # Validate file type
@@ -111,63 +212,53 @@ async def predict_video(
     start_time = time.time()
     
     try:
-        # Read file content
-        content = await file.read()
-        
-        # Check file size
-        if len(content) > MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=413,
-                detail=f"File too large. Max: {MAX_FILE_SIZE/(1024*1024):.0f}MB"
-            )
-        
         # ========================================
-        # STEP 1: Compute video hash
+        # STEP 1: Stream upload to disk, hashing as we go
         # ========================================
-        from video_hash import compute_video_hash_from_bytes
-        video_hash = compute_video_hash_from_bytes(content)
-        file_size = len(content)
+        video_hasher = new_video_hasher()
+        file_size = 0
         
-        logger.info(f"Video hash: {video_hash[:16]}... ({file_size:,} bytes)")
+        with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as temp:
+            temp_path = temp.name
+            while chunk := await file.read(HASH_CHUNK_SIZE):
+                file_size += len(chunk)
+                
+                # Check file size
+                if file_size > MAX_FILE_SIZE:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File too large. Max: {MAX_FILE_SIZE/(1024*1024):.0f}MB"
+                    )
+                
+                video_hasher.update(chunk)
+                temp.write(chunk)
+        
+        # Hashed exactly once, in the same pass that writes the temp file;
+        # every later stage (dedup, database, blockchain) uses this SHA-256
+        digest = FileDigest(video_hasher.hexdigest(), file_size)
+        
+        logger.info(f"Video hash: {digest.hex[:16]}... ({digest.size:,} bytes)")
         
         # ========================================
         # STEP 2: Check if already analyzed
         # ========================================
-        existing = db.query(VideoAnalysis).filter(
-            VideoAnalysis.video_hash == video_hash
-        ).first()
+        existing = await db.scalar(select(VideoAnalysis).where(
+            VideoAnalysis.video_hash == digest.hex
+        ))
         
         if existing:
             logger.info(f" Cache hit! Video already analyzed (ID: {existing.id})")
             
-            return {
-                "filename": file.filename,
-                "prediction": existing.prediction,
-                "confidence": existing.confidence,
-                "status": "success",
-                "cached": True,
-                "original_filename": existing.filename,
-                "analysis_timestamp": existing.analysis_timestamp.isoformat(),
-                "video_hash": video_hash,
-                "blockchain_tx_hash": existing.blockchain_tx_hash,
-                "blockchain_url": existing.blockchain_url,
-                "blockchain_verified": existing.blockchain_verified,
-                "gradcam_frames": []  # Not stored in DB to save space
-            }
+            return cached_analysis_response(file.filename, existing)
         
         # ========================================
         # STEP 3: New video - Perform analysis
         # ========================================
         logger.info(f" New video - performing AI analysis...")
         
-        # Save to temp file for analysis
-        with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as temp:
-            temp.write(content)
-            temp_path = temp.name
-        
-        # Run AI analysis
-        prediction, score, gradcam_frames = analyze_video_with_gradcam(
-            model, temp_path, generate_visualization=True
+        # Run AI analysis in the model worker
+        prediction, score, gradcam_frames = await asyncio.get_running_loop().run_in_executor(
+            None, model_worker.submit, temp_path
         )
         
         analysis_duration = time.time() - start_time
@@ -178,65 +269,43 @@ async def predict_video(
         )
         
         # ========================================
-        # STEP 4: Log to blockchain
-        # ========================================
-        blockchain_result = None
-        blockchain_tx_hash = None
-        blockchain_url = None
-        
-        try:
-            logger.info(" Logging to blockchain...")
-            
-            is_fake = prediction == "FAKE"
-            confidence_int = int(score * 100)
-            
-            blockchain_result = blockchain_service.log_evidence(
-                video_hash=video_hash,
-                is_fake=is_fake,
-                confidence=confidence_int
-            )
-            
-            if blockchain_result['success']:
-                blockchain_tx_hash = blockchain_result['tx_hash']
-                blockchain_url = blockchain_result['etherscan_url']
-                logger.info(f" Blockchain TX: {blockchain_tx_hash}")
-                
-                # Save blockchain log
-                blockchain_log = BlockchainLog(
-                    tx_hash=blockchain_tx_hash,
-                    video_hash=video_hash,
-                    is_fake=is_fake,
-                    confidence=confidence_int,
-                    status="pending"
-                )
-                db.add(blockchain_log)
-            else:
-                logger.error(f"❌ Blockchain error: {blockchain_result.get('error')}")
-                
-        except Exception as e:
-            logger.error(f"Blockchain logging failed: {e}")
-        
-        # ========================================
-        # STEP 5: Save to database
+        # STEP 4: Save to database
         # ========================================
-        analysis_record = VideoAnalysis(
-            video_hash=video_hash,
+        analysis_id = await insert_video_analysis(
+            db,
+            video_hash=digest.hex,
             filename=file.filename,
-            file_size=file_size,
+            file_size=digest.size,
             prediction=prediction,
             confidence=score,
-            blockchain_tx_hash=blockchain_tx_hash,
+            blockchain_tx_hash=None,  # Filled in by the background task
             blockchain_verified=False,  # Will be updated by background task
-            blockchain_url=blockchain_url,
+            blockchain_url=None,
             analysis_duration=analysis_duration,
             gradcam_generated=len(gradcam_frames) > 0
         )
         
-        db.add(analysis_record)
-        db.commit()
-        db.refresh(analysis_record)
+        if analysis_id is None:
+            # A concurrent upload of the same video was stored first; it
+            # owns the blockchain submission
+            existing = await db.scalar(select(VideoAnalysis).where(
+                VideoAnalysis.video_hash == digest.hex
+            ))
+            logger.info(f" Video stored concurrently (ID: {existing.id})")
+            return cached_analysis_response(file.filename, existing, gradcam_frames)
         
-        logger.info(f" Saved to database (ID: {analysis_record.id})")
+        logger.info(f" Saved to database (ID: {analysis_id})")
+        
+        # ========================================
+        # STEP 5: Log to blockchain (after the response is sent)
+        # ========================================
+        background_tasks.add_task(
+            submit_to_blockchain,
+            analysis_id,
+            digest,
+            prediction == "FAKE",
+            int(score * 100)
+        )
         
         # ========================================
         # STEP 6: Return results
@@ -247,15 +316,19 @@ async def predict_video(
             "confidence": round(score, 4),
             "status": "success",
             "cached": False,
-            "video_hash": video_hash,
-            "analysis_id": analysis_record.id,
-            "blockchain_tx_hash": blockchain_tx_hash,
-            "blockchain_url": blockchain_url,
+            "video_hash": digest.hex,
+            "analysis_id": analysis_id,
+            "blockchain_tx_hash": None,
+            "blockchain_url": None,
             "blockchain_verified": False,
+            "blockchain_pending": True,  # Poll /analysis/{video_hash} for the tx
             "gradcam_frames": gradcam_frames,
             "analysis_duration": round(analysis_duration, 2)
         }
     
+    except HTTPException:
+        raise
+    
     except Exception as e:
         logger.error(f"Error analyzing video: {str(e)}")
         raise HTTPException(
@@ -273,13 +346,16 @@ async def predict_video(
 
 
 @app.get("/analysis/{video_hash}")
-async def get_analysis(video_hash: str, db: Session = Depends(get_db)):
+async def get_analysis(video_hash: str, db: AsyncSession = Depends(get_db)):
     """
     Get analysis by video hash
     """
-    analysis = db.query(VideoAnalysis).filter(
+    if not is_hex_digest(video_hash):
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    
+    analysis = await db.scalar(select(VideoAnalysis).where(
         VideoAnalysis.video_hash == video_hash
-    ).first()
+    ))
     
     if not analysis:
         raise HTTPException(status_code=404, detail="Analysis not found")
@@ -288,26 +364,31 @@ async def get_analysis(video_hash: str, db: Session = Depends(get_db)):
 
 
 @app.get("/blockchain/{tx_hash}")
-async def get_blockchain_status(tx_hash: str, db: Session = Depends(get_db)):
+async def get_blockchain_status(tx_hash: str, db: AsyncSession = Depends(get_db)):
     """
     Check blockchain transaction status
     """
-    log = db.query(BlockchainLog).filter(
+    if not is_hex_digest(tx_hash, prefixed=True):
+        raise HTTPException(status_code=404, detail="Transaction not found")
+    
+    log = await db.scalar(select(BlockchainLog).where(
         BlockchainLog.tx_hash == tx_hash
-    ).first()
+    ))
     
     if not log:
         raise HTTPException(status_code=404, detail="Transaction not found")
     
     # Check current status on blockchain
-    receipt = blockchain_service.get_transaction_receipt(tx_hash)
+    receipt = await asyncio.get_running_loop().run_in_executor(
+        None, blockchain_service.get_transaction_receipt, tx_hash
+    )
     
     if receipt['confirmed'] and log.status == "pending":
         # Update status
         log.status = "confirmed" if receipt['status'] == 1 else "failed"
         log.block_number = receipt['block_number']
         log.gas_used = receipt['gas_used']
-        db.commit()
+        await db.commit()
     
     return {
         **log.to_dict(),
@@ -319,18 +400,19 @@ async def get_blockchain_status(tx_hash: str, db: Session = Depends(get_db)):
 async def get_history(
     limit: int = 50,
     offset: int = 0,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get analysis history
     """
-    analyses = db.query(VideoAnalysis).order_by(
-        VideoAnalysis.analysis_timestamp.desc()
-    ).offset(offset).limit(limit).all()
-    
-    return {
-        "total": db.query(VideoAnalysis).count(),
+    history = {
+        "total": await db.scalar(select(func.count(VideoAnalysis.id))),
         "limit": limit,
         "offset": offset,
-        "analyses": [a.to_dict() for a in analyses]
-    }
\ No newline at end of file
+        "analyses": await VideoAnalysis.list_as_dicts(db, limit, offset)
+    }
+    
+    # orjson encodes the rows (datetimes included) in one native pass
+    if orjson is not None:
+        return Response(orjson.dumps(history), media_type="application/json")
+    return history
\ No newline at end of file
@@ -0,0 +1,299 @@
+"""
+Face Detection
+Finds the largest face per frame, batched through an ONNX CNN detector
+(UltraFace on ONNX Runtime, or YuNet on OpenCV DNN) with the OpenCV Haar
+cascade as fallback
+"""
+
+import cv2
+import numpy as np
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+logger = logging.getLogger(__name__)
+
+# UltraFace RFB-320 (https://github.com/Linzaer/Ultra-Light-Fast-Generic-Face-Detector-1MB)
+ULTRAFACE_PATH = os.getenv(
+    "ULTRAFACE_PATH", os.path.join(os.path.dirname(__file__), "ultraface.onnx")
+)
+ULTRAFACE_INPUT_SIZE = (320, 240)  # (width, height)
+SCORE_THRESHOLD = 0.7
+NMS_THRESHOLD = 0.3
+
+# YuNet (https://github.com/opencv/opencv_zoo/tree/main/models/face_detection_yunet)
+YUNET_PATH = os.getenv(
+    "YUNET_PATH",
+    os.path.join(os.path.dirname(__file__), "face_detection_yunet_2023mar.onnx")
+)
+YUNET_MAX_WIDTH = 640
+
+HAAR_CASCADE_PATH = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+HAAR_MAX_WIDTH = 640
+HAAR_MIN_FACE_SIZE = (40, 40)  # at native resolution; prunes the smallest pyramid levels
+face_cascade = cv2.CascadeClassifier(HAAR_CASCADE_PATH)
+
+# Haar preprocessing + detection on OpenCL through cv2.UMat (T-API)
+USE_OPENCL = os.getenv("USE_OPENCL", "0") == "1" and cv2.ocl.haveOpenCL()
+cv2.ocl.setUseOpenCL(USE_OPENCL)
+
+# Per-thread scratch buffers (one per distinct purpose and frame shape)
+SCRATCH_BUFFER_LIMIT = 8
+
+# YuNet / Haar detection fans out across frames; OpenCV releases the GIL
+# inside detect() / detectMultiScale. Neither detector is safe to share
+# between threads, so each worker loads its own.
+_thread_state = threading.local()
+
+
+def _create_yunet():
+    """Create a YuNet detector, or None if unavailable"""
+    if not hasattr(cv2, "FaceDetectorYN") or not os.path.exists(YUNET_PATH):
+        return None
+
+    try:
+        # Input size is set per frame in _detect_yunet
+        return cv2.FaceDetectorYN.create(
+            YUNET_PATH, "", (320, 320), SCORE_THRESHOLD, NMS_THRESHOLD
+        )
+    except cv2.error as e:
+        logger.warning(f"Failed to load YuNet: {e}")
+        return None
+
+
+yunet_available = _create_yunet() is not None
+
+
+def _scratch_buffer(name, shape, dtype=np.uint8):
+    """Per-thread array reused across frames of the same shape"""
+    buffers = _thread_state.__dict__.setdefault('buffers', {})
+    key = (name, shape)
+    buffer = buffers.get(key)
+    if buffer is None:
+        if len(buffers) >= SCRATCH_BUFFER_LIMIT:
+            buffers.clear()  # resolution changed between videos
+        buffer = buffers[key] = np.empty(shape, dtype)
+    return buffer
+
+
+def cvt_color_buffered(src, code):
+    """
+    cv2.cvtColor into a reusable per-thread output buffer
+
+    Supports BGR/RGB -> GRAY and BGR <-> RGB. The result is overwritten by
+    the next call with the same code and shape on this thread, so copy it
+    if it has to outlive the current frame.
+    """
+    if code in (cv2.COLOR_BGR2GRAY, cv2.COLOR_RGB2GRAY):
+        shape = src.shape[:2]
+    else:
+        shape = src.shape
+    return cv2.cvtColor(src, code, dst=_scratch_buffer(code, shape))
+
+
+def _init_detection_worker():
+    _thread_state.cascade = cv2.CascadeClassifier(HAAR_CASCADE_PATH)
+    _thread_state.yunet = _create_yunet() if yunet_available else None
+
+
+detection_pool = ThreadPoolExecutor(
+    max_workers=os.cpu_count() or 1,
+    thread_name_prefix="face-detect",
+    initializer=_init_detection_worker
+)
+
+
+def _load_ultraface():
+    """Create the UltraFace ONNX Runtime session, or None if unavailable"""
+    if ort is None or not os.path.exists(ULTRAFACE_PATH):
+        logger.info("UltraFace model not available, using fallback detector")
+        return None
+
+    providers = [
+        p for p in ("CUDAExecutionProvider", "CPUExecutionProvider")
+        if p in ort.get_available_providers()
+    ]
+    try:
+        return ort.InferenceSession(ULTRAFACE_PATH, providers=providers)
+    except Exception as e:
+        logger.warning(f"Failed to load UltraFace, using fallback detector: {e}")
+        return None
+
+
+ultraface_session = _load_ultraface()
+if ultraface_session is None and yunet_available:
+    logger.info("Using YuNet face detector")
+
+
+def _largest_box(boxes):
+    """Pick the largest (x, y, w, h) box, or None if there is no valid one"""
+    if len(boxes) == 0:
+        return None
+
+    x, y, w, h = (int(v) for v in max(boxes, key=lambda b: b[2] * b[3]))
+
+    if w <= 0 or h <= 0:
+        return None
+
+    return x, y, w, h
+
+
+def _detect_haar(frame):
+    """
+    Detect the largest face in a single BGR frame with the Haar cascade
+
+    Detection runs on a copy downscaled to at most ~HAAR_MAX_WIDTH wide
+    (cascade cost is linear in pixels); the box is scaled back so the crop
+    is taken at native resolution.
+    """
+    cascade = getattr(_thread_state, 'cascade', face_cascade)
+    height, width = frame.shape[:2]
+    scale = max(1, width // HAAR_MAX_WIDTH)
+    size = (width // scale, height // scale)
+
+    if USE_OPENCL:
+        # Upload once; convert, resize and detect stay on the device
+        gray = cv2.cvtColor(cv2.UMat(frame), cv2.COLOR_BGR2GRAY)
+        if scale > 1:
+            gray = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+    else:
+        gray = cvt_color_buffered(frame, cv2.COLOR_BGR2GRAY)
+        if scale > 1:
+            gray = cv2.resize(
+                gray, size, dst=_scratch_buffer('haar_small', size[::-1]),
+                interpolation=cv2.INTER_AREA
+            )
+
+    # Same minimum face at native resolution whatever the downscale (the
+    # cascade's 24x24 window still bounds what it can find at this scale)
+    min_size = tuple(max(1, v // scale) for v in HAAR_MIN_FACE_SIZE)
+    faces = cascade.detectMultiScale(gray, 1.1, 4, minSize=min_size)
+    box = _largest_box(faces)
+
+    if box is None:
+        return None
+
+    return tuple(v * scale for v in box)
+
+
+def _detect_yunet(frame):
+    """
+    Detect the largest face in a single BGR frame with YuNet
+
+    Like the Haar path, detection runs on a copy downscaled to at most
+    ~YUNET_MAX_WIDTH wide and the box is scaled back to native resolution.
+    """
+    detector = getattr(_thread_state, 'yunet', None)
+    if detector is None:
+        return _detect_haar(frame)
+
+    height, width = frame.shape[:2]
+    scale = max(1, width // YUNET_MAX_WIDTH)
+    if scale > 1:
+        frame = cv2.resize(
+            frame, (frame.shape[1] // scale, frame.shape[0] // scale),
+            interpolation=cv2.INTER_AREA
+        )
+
+    detector.setInputSize((frame.shape[1], frame.shape[0]))
+    _, faces = detector.detect(frame)
+    if faces is None:
+        return None
+
+    # Rows are [x, y, w, h, 5 landmarks (x, y), score]; boxes of faces at the
+    # frame edge extend past it, so clip them like the UltraFace path
+    corners = faces[:, :4] * scale
+    corners[:, 2:] += corners[:, :2]
+    corners[:, 0::2] = np.clip(corners[:, 0::2], 0, width)
+    corners[:, 1::2] = np.clip(corners[:, 1::2], 0, height)
+    corners[:, 2:] -= corners[:, :2]
+    return _largest_box(corners)
+
+
+def _ultraface_input(frame):
+    """Resize a BGR frame to the detector input and normalize to NCHW float"""
+    resized = cv2.resize(frame, ULTRAFACE_INPUT_SIZE)
+    rgb = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
+    return ((rgb.astype(np.float32) - 127.0) / 128.0).transpose(2, 0, 1)
+
+
+def _decode_ultraface(scores, boxes, frame_shape):
+    """Convert one frame's UltraFace outputs to the largest pixel box"""
+    height, width = frame_shape[:2]
+
+    confidences = scores[:, 1]
+    keep = confidences > SCORE_THRESHOLD
+    if not np.any(keep):
+        return None
+
+    # Normalized corners -> pixel (x, y, w, h)
+    corners = boxes[keep] * np.array([width, height, width, height], dtype=np.float32)
+    corners[:, 0::2] = np.clip(corners[:, 0::2], 0, width)
+    corners[:, 1::2] = np.clip(corners[:, 1::2], 0, height)
+    xywh = np.column_stack([
+        corners[:, 0], corners[:, 1],
+        corners[:, 2] - corners[:, 0], corners[:, 3] - corners[:, 1]
+    ])
+
+    indices = cv2.dnn.NMSBoxes(
+        xywh.tolist(), confidences[keep].tolist(), SCORE_THRESHOLD, NMS_THRESHOLD
+    )
+    return _largest_box(xywh[np.array(indices).flatten()])
+
+
+def _detect_ultraface(frames):
+    """Detect the largest face per frame with one UltraFace session.run"""
+    input_meta = ultraface_session.get_inputs()[0]
+    batch = np.stack([_ultraface_input(frame) for frame in frames])
+
+    # Exported models with a fixed batch dimension have to run frame by frame
+    if isinstance(input_meta.shape[0], int) and input_meta.shape[0] != len(frames):
+        outputs = [ultraface_session.run(None, {input_meta.name: b[None]}) for b in batch]
+        scores = np.concatenate([o[0] for o in outputs])
+        boxes = np.concatenate([o[1] for o in outputs])
+    else:
+        scores, boxes = ultraface_session.run(None, {input_meta.name: batch})
+
+    return [
+        _decode_ultraface(scores[i], boxes[i], frame.shape)
+        for i, frame in enumerate(frames)
+    ]
+
+
+def detect_faces(frames):
+    """
+    Detect the largest face in each frame
+
+    Args:
+        frames: List of video frames (BGR numpy arrays)
+
+    Returns:
+        list: (x, y, w, h) per frame, None where no face was found
+    """
+    valid = [i for i, f in enumerate(frames) if f is not None and f.size > 0]
+    results = [None] * len(frames)
+
+    if not valid:
+        return results
+
+    if ultraface_session is not None:
+        try:
+            boxes = _detect_ultraface([frames[i] for i in valid])
+            for i, box in zip(valid, boxes):
+                results[i] = box
+            return results
+        except Exception as e:
+            logger.warning(f"UltraFace detection failed, using fallback detector: {e}")
+
+    detect = _detect_yunet if yunet_available else _detect_haar
+    boxes = detection_pool.map(detect, [frames[i] for i in valid])
+    for i, box in zip(valid, boxes):
+        results[i] = box
+
+    return results
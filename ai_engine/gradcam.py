@@ -2,13 +2,90 @@ import torch
 import torch.nn.functional as F
 import cv2
 import numpy as np
-from PIL import Image
-from torchvision import transforms
+import threading
+from collections import OrderedDict
+
+from face_detection import detect_faces, cvt_color_buffered
+
+
+# cv::CPU_AVX2 (the Python bindings do not export the CpuFeatures enum)
+_CV_CPU_AVX2 = 11
+
+
+def _opencv_has_avx2():
+    """
+    Whether OpenCV can run its AVX2 kernels (e.g. the F32C1 bilinear resize)
+    
+    Needs both a build that dispatches AVX2 code and a CPU that supports it.
+    """
+    for line in cv2.getBuildInformation().splitlines():
+        if "Dispatched code generation" in line:
+            dispatched = line.split(":", 1)[1].split()
+            return "AVX2" in dispatched and cv2.checkHardwareSupport(_CV_CPU_AVX2)
+    return False
+
+
+OPENCV_AVX2 = _opencv_has_avx2()
+if not OPENCV_AVX2:
+    print("Warning: OpenCV AVX2 kernels unavailable, heatmap resize uses the baseline SIMD path")
+
+
+def _resize_f32c1(src, dsize):
+    """
+    Bilinear resize of a single-channel float32 map
+    
+    Feeds cv2.resize a contiguous float32 array, the layout its
+    vectorized F32C1 kernel expects (other dtypes or strides take a
+    generic path).
+    
+    Args:
+        src: (h, w) array
+        dsize: Output size as (width, height)
+    """
+    src = np.ascontiguousarray(src, dtype=np.float32)
+    return cv2.resize(src, dsize, interpolation=cv2.INTER_LINEAR)
+
+
+def _gradcam_autocast(input_tensor):
+    """
+    Mixed precision context for the Grad-CAM forward pass
+    
+    BF16 is preferred where supported: the backward runs without a gradient
+    scaler, and BF16 keeps FP32's exponent range so small gradients do not
+    underflow. Disabled on CPU.
+    """
+    if not input_tensor.is_cuda:
+        return torch.autocast("cpu", enabled=False)
+    
+    dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+    return torch.autocast("cuda", dtype=dtype)
+
+
+def _channels_last(input_tensor):
+    """
+    NHWC copy of a CUDA input batch, matching the channels_last model
+    load_model builds on GPU (cuDNN picks Tensor Core kernels without
+    layout transposes). CPU inputs stay NCHW like the CPU model.
+    """
+    if input_tensor.is_cuda:
+        return input_tensor.contiguous(memory_format=torch.channels_last)
+    return input_tensor
+
+
+# GradCAM instances (and their hooks) are reused per (model, layer)
+GRADCAM_CACHE_SIZE = 4
+
+# Faces scoring at or below this are not worth a heatmap (the overlay turns
+# yellow / red above 0.5, see create_gradcam_visualization)
+GRADCAM_SHOW_THRESHOLD = 0.5
+
 
 class GradCAM:
     """
     Grad-CAM implementation for visualizing model attention on deepfake detection
     """
+    _lut_cache = {}
+    
     def __init__(self, model, target_layer):
         """
         Args:
@@ -20,53 +97,80 @@ class GradCAM:
         self.gradients = None
         self.activations = None
         
-        # Register hooks
-        self.target_layer.register_forward_hook(self.save_activation)
-        self.target_layer.register_backward_hook(self.save_gradient)
+        # Register hooks (removed again by close()). Gradients are taken
+        # directly w.r.t. the hooked activations with torch.autograd.grad,
+        # so no backward hook is needed.
+        self._handles = [
+            self.target_layer.register_forward_hook(self.save_activation)
+        ]
+    
+    def close(self):
+        """Remove the hooks from the target layer"""
+        # getattr: __del__ also runs if __init__ failed before registering
+        for handle in getattr(self, '_handles', ()):
+            handle.remove()
+        self._handles = []
+    
+    def __del__(self):
+        self.close()
     
     def save_activation(self, module, input, output):
-        """Hook to save forward pass activations"""
-        self.activations = output.detach()
+        """Hook to save forward pass activations (still attached to the graph)"""
+        # The hooked model is shared with plain scoring passes; only
+        # Grad-CAM passes (grad enabled) need the activations
+        if torch.is_grad_enabled():
+            self.activations = output
     
-    def save_gradient(self, module, grad_input, grad_output):
-        """Hook to save backward pass gradients"""
-        self.gradients = grad_output[0].detach()
+    def _activation_gradients(self, target):
+        """
+        Gradient of a scalar target w.r.t. the hooked activations
+        
+        Uses torch.autograd.grad, which only computes what is needed for
+        the activations and never touches parameter .grad buffers. The
+        graph is released, and the stored activations are detached.
+        """
+        activations = self.activations
+        gradients, = torch.autograd.grad(target, activations)
+        
+        self.activations = activations.detach()
+        self.gradients = gradients
+        return gradients, self.activations
     
     def generate_cam(self, input_tensor, target_class=None):
         """
         Generate Class Activation Map
         
+        The model must already be in eval mode (load_model does this).
+        
         Args:
             input_tensor: Input image tensor (1, C, H, W)
             target_class: Target class index (0 for real, 1 for fake)
                          If None, uses the predicted class
         
         Returns:
-            cam: Numpy array of the CAM heatmap
+            cam: CAM heatmap tensor (h, w) in [0, 1], on the model's device
             prediction: Model prediction score
         """
-        self.model.eval()
+        # The model is put in eval mode once by load_model; grad is forced on
+        # in case the caller runs under no_grad
+        with torch.enable_grad():
+            # Forward pass (mixed precision on CUDA; backward runs outside autocast)
+            with _gradcam_autocast(input_tensor):
+                output = self.model(_channels_last(input_tensor))
+            output = output.float()
+            prediction = torch.sigmoid(output).item()
+            
+            # If no target class specified, use predicted class
+            if target_class is None:
+                target_class = 1 if prediction > 0.5 else 0
+            
+            # Gradients for target class
+            target = output.sum() if target_class == 1 else -output.sum()
+            gradients, activations = self._activation_gradients(target)
         
-        # Forward pass
-        output = self.model(input_tensor)
-        prediction = torch.sigmoid(output).item()
-        
-        # If no target class specified, use predicted class
-        if target_class is None:
-            target_class = 1 if prediction > 0.5 else 0
-        
-        # Zero gradients
-        self.model.zero_grad()
-        
-        # Backward pass for target class
-        if target_class == 1:
-            output.backward()
-        else:
-            (-output).backward()
-        
-        # Get gradients and activations
-        gradients = self.gradients  # (1, C, H, W)
-        activations = self.activations  # (1, C, H, W)
+        # Upcast from FP16/BF16 under autocast; back to NCHW for the CAM math
+        gradients = gradients.float().contiguous()  # (1, C, H, W)
+        activations = activations.float().contiguous()  # (1, C, H, W)
         
         # Global average pooling on gradients
         weights = torch.mean(gradients, dim=(2, 3), keepdim=True)  # (1, C, 1, 1)
@@ -77,113 +181,277 @@ class GradCAM:
         # Apply ReLU to keep only positive influences
         cam = F.relu(cam)
         
-        # Normalize to [0, 1]
-        cam = cam.squeeze().cpu().numpy()
-        if cam.max() > 0:
-            cam = cam / cam.max()
+        # Normalize to [0, 1] (stays on device)
+        cam = cam.squeeze(0).squeeze(0)
+        cam = cam / cam.max().clamp_min(1e-12)
         
         return cam, prediction
     
+    def generate_cams(self, input_tensor):
+        """
+        Generate Class Activation Maps for a batch in one forward + backward
+        
+        Each sample targets its own predicted class. Samples do not interact
+        in eval mode, so the gradient of the signed sum of the logits gives
+        every sample the gradient of its own target. The model must already
+        be in eval mode (load_model does this).
+        
+        Args:
+            input_tensor: Input image tensor (B, C, H, W)
+        
+        Returns:
+            cams: CAM heatmap tensor (B, h, w) in [0, 1], on the model's device
+            predictions: List of model prediction scores
+        """
+        # The model is put in eval mode once by load_model; grad is forced on
+        # in case the caller runs under no_grad
+        with torch.enable_grad():
+            # Forward pass (mixed precision on CUDA; backward runs outside autocast)
+            with _gradcam_autocast(input_tensor):
+                output = self.model(_channels_last(input_tensor))
+            output = output.float().view(-1)  # (B,)
+            predictions = torch.sigmoid(output).detach()
+            
+            # +1 for samples predicted fake, -1 for real
+            signs = (predictions > 0.5).to(output.dtype) * 2 - 1
+            
+            gradients, activations = self._activation_gradients((signs * output).sum())
+        
+        # Upcast from FP16/BF16 under autocast; back to NCHW for the CAM math
+        gradients = gradients.float().contiguous()  # (B, C, H, W)
+        activations = activations.float().contiguous()  # (B, C, H, W)
+        
+        # Global average pooling on gradients, weighted sum of activation maps
+        weights = gradients.mean(dim=(2, 3), keepdim=True)  # (B, C, 1, 1)
+        cams = F.relu((weights * activations).sum(dim=1))  # (B, H, W)
+        
+        # Normalize each map to [0, 1] (stays on device)
+        cams = cams / cams.amax(dim=(1, 2), keepdim=True).clamp_min(1e-12)
+        
+        return cams, predictions.tolist()
+    
+    @classmethod
+    def _colormap_lut(cls, colormap, device=None):
+        """
+        RGB lookup table for an OpenCV colormap
+        
+        Cached per colormap as a (256, 1, 3) uint8 array (device=None, the
+        user-LUT form cv2.applyColorMap accepts) and as a (256, 3) float
+        tensor per device.
+        """
+        key = (colormap, None if device is None else str(device))
+        if key not in cls._lut_cache:
+            if device is None:
+                bgr = cv2.applyColorMap(np.arange(256, dtype=np.uint8).reshape(-1, 1), colormap)
+                cls._lut_cache[key] = np.ascontiguousarray(bgr[:, :, ::-1])
+            else:
+                lut = cls._colormap_lut(colormap).reshape(256, 3)
+                cls._lut_cache[key] = torch.from_numpy(lut).to(device).float()
+        return cls._lut_cache[key]
+    
     def overlay_heatmap(self, heatmap, original_image, alpha=0.5, colormap=cv2.COLORMAP_JET):
         """
         Overlay heatmap on original image
         
+        The colormap is applied as a single LUT gather straight to RGB. On
+        CUDA, resize, colormap and blend run on the device and only the final
+        uint8 overlay is copied back; on CPU the same steps run in NumPy /
+        OpenCV on uint8 data.
+        
         Args:
-            heatmap: CAM heatmap (H, W)
+            heatmap: CAM heatmap tensor (h, w) in [0, 1]
             original_image: Original image as numpy array (H, W, C) in RGB
             alpha: Transparency of heatmap overlay
             colormap: OpenCV colormap to use
         
         Returns:
-            Blended image with heatmap overlay
+            Blended image with heatmap overlay (numpy uint8, RGB)
         """
+        if heatmap.device.type == 'cpu':
+            return self._overlay_heatmap_numpy(heatmap, original_image, alpha, colormap)
+        
+        device = heatmap.device
+        height, width = original_image.shape[:2]
+        
         # Resize heatmap to match original image
-        heatmap_resized = cv2.resize(heatmap, (original_image.shape[1], original_image.shape[0]))
+        heatmap_resized = F.interpolate(
+            heatmap[None, None].float(), size=(height, width),
+            mode='bilinear', align_corners=False
+        )[0, 0]
         
-        # Convert heatmap to uint8
-        heatmap_uint8 = np.uint8(255 * heatmap_resized)
+        # Convert heatmap to uint8 indices and apply colormap via LUT gather
+        heatmap_idx = (heatmap_resized * 255).clamp(0, 255).long()
+        heatmap_colored = self._colormap_lut(colormap, device)[heatmap_idx]
         
-        # Apply colormap
-        heatmap_colored = cv2.applyColorMap(heatmap_uint8, colormap)
+        # Blend images
+        image = torch.from_numpy(np.ascontiguousarray(original_image)).to(device).float()
+        overlay = (alpha * heatmap_colored + (1 - alpha) * image).round().clamp(0, 255)
+        
+        return overlay.to(torch.uint8).cpu().numpy()
+    
+    def _overlay_heatmap_numpy(self, heatmap, original_image, alpha, colormap):
+        """CPU overlay_heatmap: uint8 colormap LUT + cv2.addWeighted"""
+        height, width = original_image.shape[:2]
+        
+        # Resize heatmap to match original image
+        heatmap_resized = _resize_f32c1(heatmap.detach().float().numpy(), (width, height))
         
-        # Convert from BGR to RGB
-        heatmap_colored = cv2.cvtColor(heatmap_colored, cv2.COLOR_BGR2RGB)
+        # Convert heatmap to uint8 and apply the RGB colormap in one
+        # vectorized LUT pass (no BGR -> RGB conversion needed)
+        heatmap_uint8 = np.clip(heatmap_resized * 255, 0, 255).astype(np.uint8)
+        heatmap_colored = cv2.applyColorMap(heatmap_uint8, self._colormap_lut(colormap))
         
         # Ensure original image is uint8
         if original_image.dtype != np.uint8:
             original_image = np.uint8(original_image)
         
         # Blend images
-        overlay = cv2.addWeighted(original_image, 1 - alpha, heatmap_colored, alpha, 0)
-        
-        return overlay
+        return cv2.addWeighted(original_image, 1 - alpha, heatmap_colored, alpha, 0)
 
 
-def analyze_frame_with_gradcam(model, frame, face_cascade, transform, device="cpu"):
+_gradcam_cache = OrderedDict()
+_gradcam_cache_lock = threading.Lock()
+
+
+def get_gradcam(model, target_layer):
     """
-    Analyze a single frame and generate Grad-CAM visualization
-    
-    Args:
-        model: Trained deepfake detection model
-        frame: Video frame (numpy array)
-        face_cascade: OpenCV face detector
-        transform: Image preprocessing transform
-        device: 'cpu' or 'cuda'
+    Return the GradCAM for (model, target_layer), creating it on first use
     
-    Returns:
-        dict with:
-            - 'score': Deepfake probability
-            - 'face_bbox': Face bounding box [x, y, w, h]
-            - 'heatmap': Grad-CAM heatmap
-            - 'overlay': Heatmap overlaid on face
-            - 'original_face': Original face crop
+    Hooks are registered once per model instead of once per call. The
+    cache holds strong references, so the ids in the key cannot be reused
+    while an entry exists; evicted entries have their hooks removed.
     """
+    key = (id(model), id(target_layer))
+    
+    with _gradcam_cache_lock:
+        gradcam = _gradcam_cache.get(key)
+        if gradcam is not None:
+            _gradcam_cache.move_to_end(key)
+            return gradcam
+        
+        gradcam = GradCAM(model, target_layer)
+        _gradcam_cache[key] = gradcam
+        if len(_gradcam_cache) > GRADCAM_CACHE_SIZE:
+            _, evicted = _gradcam_cache.popitem(last=False)
+            evicted.close()
+        
+        return gradcam
+
+
+def _largest_face(frame, face_cascade):
+    """Largest (x, y, w, h) face in a BGR frame, or None"""
     if frame is None or frame.size == 0:
         return None
     
-    # Detect face
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    gray = cvt_color_buffered(frame, cv2.COLOR_BGR2GRAY)
     faces = face_cascade.detectMultiScale(gray, 1.1, 4)
     
     if len(faces) == 0:
         return None
     
-    # Get largest face
     x, y, w, h = max(faces, key=lambda b: b[2] * b[3])
     
     if w <= 0 or h <= 0:
         return None
     
-    # Extract face
-    face = frame[y:y+h, x:x+w]
-    face_rgb = cv2.cvtColor(face, cv2.COLOR_BGR2RGB)
+    return int(x), int(y), int(w), int(h)
+
+
+def analyze_frames_batch(model, frames, face_cascade, transform, device="cpu", batch=32):
+    """
+    Analyze several frames and generate their Grad-CAM visualizations
+    
+    All frames go through face detection in one call, and the detected
+    faces are stacked and run through one Grad-CAM forward + backward per
+    `batch` faces instead of one per frame.
+    
+    Args:
+        model: Trained deepfake detection model
+        frames: List of video frames (numpy arrays)
+        face_cascade: OpenCV face detector, or None to use the batched
+                      DNN detector from face_detection (Haar as fallback)
+        transform: Preprocessing callable mapping a list of RGB crops to a batch
+        device: 'cpu' or 'cuda'
+        batch: Maximum number of faces per forward pass
+    
+    Returns:
+        list: One entry per frame, as analyze_frame_with_gradcam (None where
+        no face was found or Grad-CAM failed)
+    """
+    results = [None] * len(frames)
+    
+    # Detect faces
+    if face_cascade is None:
+        boxes = detect_faces(frames)
+    else:
+        boxes = [_largest_face(frame, face_cascade) for frame in frames]
+    
+    detected = []
+    for i, (frame, box) in enumerate(zip(frames, boxes)):
+        if box is not None:
+            x, y, w, h = box
+            face_rgb = cv2.cvtColor(frame[y:y+h, x:x+w], cv2.COLOR_BGR2RGB)
+            detected.append((i, box, face_rgb))
     
-    # Prepare for model
-    face_pil = Image.fromarray(face_rgb)
-    tensor = transform(face_pil).unsqueeze(0).to(device)
+    if not detected:
+        return results
+    
+    # Grad-CAM needs autograd, so accelerated wrappers (e.g. TensorRT)
+    # hand back the eager model they were built from
+    model = getattr(model, 'module', model)
     
     # Initialize Grad-CAM
     # For EfficientNet, use the last convolutional layer
     target_layer = model.features[-1]
-    gradcam = GradCAM(model, target_layer)
-    
-    # Generate CAM
-    try:
-        cam, score = gradcam.generate_cam(tensor)
-        
-        # Create overlay
-        overlay = gradcam.overlay_heatmap(cam, face_rgb, alpha=0.4)
-        
-        return {
-            'score': score,
-            'face_bbox': [int(x), int(y), int(w), int(h)],
-            'heatmap': cam,
-            'overlay': overlay,
-            'original_face': face_rgb
-        }
-    except Exception as e:
-        print(f"Error generating Grad-CAM: {e}")
-        return None
+    gradcam = get_gradcam(model, target_layer)
+    
+    for start in range(0, len(detected), batch):
+        chunk = detected[start:start + batch]
+        
+        try:
+            # Prepare for model
+            tensor = transform([face_rgb for _, _, face_rgb in chunk]).to(device)
+            
+            # Generate CAMs
+            cams, scores = gradcam.generate_cams(tensor)
+            
+            for (i, box, face_rgb), cam, score in zip(chunk, cams, scores):
+                # Create overlay
+                overlay = gradcam.overlay_heatmap(cam, face_rgb, alpha=0.4)
+                
+                results[i] = {
+                    'score': score,
+                    'face_bbox': list(box),
+                    'heatmap': cam,
+                    'overlay': overlay,
+                    'original_face': face_rgb
+                }
+        except Exception as e:
+            print(f"Error generating Grad-CAM: {e}")
+    
+    return results
+
+
+def analyze_frame_with_gradcam(model, frame, face_cascade, transform, device="cpu"):
+    """
+    Analyze a single frame and generate Grad-CAM visualization
+    
+    Args:
+        model: Trained deepfake detection model
+        frame: Video frame (numpy array)
+        face_cascade: OpenCV face detector, or None to use face_detection
+        transform: Preprocessing callable mapping a list of RGB crops to a batch
+        device: 'cpu' or 'cuda'
+    
+    Returns:
+        dict with:
+            - 'score': Deepfake probability
+            - 'face_bbox': Face bounding box [x, y, w, h]
+            - 'heatmap': Grad-CAM heatmap (tensor on device)
+            - 'overlay': Heatmap overlaid on face
+            - 'original_face': Original face crop
+    """
+    return analyze_frames_batch(model, [frame], face_cascade, transform, device)[0]
 
 
 def create_gradcam_visualization(original_frame, gradcam_result):
@@ -1,70 +1,517 @@
 import cv2
 import torch
-from torchvision import transforms
-from PIL import Image
+import torch.nn.functional as F
 import numpy as np
 import base64
-from io import BytesIO
+import threading
+import queue
+from collections import OrderedDict
+
+from model_loader import inference_autocast
+
+__all__ = [
+    "DEVICE",
+    "BATCH_SIZE",
+    "transform",
+    "crop_face",
+    "face_phash",
+    "detect_and_crop",
+    "score_faces",
+    "predict_frames",
+    "predict_frame",
+    "iter_frame_samples",
+    "iter_face_batches",
+    "process_video_threads",
+    "encode_jpeg_base64",
+    "render_gradcam_frames",
+    "analyze_video_with_gradcam",
+    "analyze_video",
+]
 
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 
+# Frames decoded and scored together per forward pass
+BATCH_SIZE = 16
+
 # =======================
 # PREPROCESSING
 # =======================
 
-transform = transforms.Compose([
-    transforms.Resize((224,224)),
-    transforms.ToTensor(),
-    transforms.Normalize([0.485,0.456,0.406],   # Standard ImageNet mean
-                         [0.229,0.224,0.225])   # Standard ImageNet std
-])
+# Standard ImageNet mean / std, pre-scaled so uint8 pixels normalize in one step
+MEAN = torch.tensor([0.485,0.456,0.406], device=DEVICE).view(1, 3, 1, 1) * 255
+STD = torch.tensor([0.229,0.224,0.225], device=DEVICE).view(1, 3, 1, 1) * 255
+INPUT_SIZE = (224, 224)
+
+
+def transform(faces):
+    """
+    Preprocess RGB face crops into a model-ready batch on DEVICE
+
+    Each uint8 crop is uploaded as-is, resized on device (bilinear with
+    antialiasing, matching PIL) and normalized, so no float intermediate
+    is ever built on the host.
+
+    Args:
+        faces: List of RGB face crops (H, W, 3) uint8, any size
+
+    Returns:
+        torch.Tensor: (B, 3, 224, 224) float32 (channels_last on CUDA)
+    """
+    resized = [
+        F.interpolate(
+            torch.from_numpy(np.ascontiguousarray(face)).to(DEVICE, non_blocking=True)
+            .permute(2, 0, 1).unsqueeze(0).float(),
+            size=INPUT_SIZE, mode='bilinear', align_corners=False, antialias=True
+        )
+        for face in faces
+    ]
+    batch = (torch.cat(resized) - MEAN) / STD
+
+    if DEVICE == "cuda":
+        # Match the model's channels_last weights (see model_loader)
+        batch = batch.contiguous(memory_format=torch.channels_last)
+
+    return batch
+
+# =======================
+# VIDEO DECODING / FACE DETECTION
+# =======================
+
+from video_reader import open_video
 
-face_cascade = cv2.CascadeClassifier(
-    cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-)
+from face_detection import detect_faces, cvt_color_buffered
 
 # =======================
 # GRAD-CAM INTEGRATION
 # =======================
 
-from gradcam import analyze_frame_with_gradcam, create_gradcam_visualization
+from gradcam import analyze_frames_batch, create_gradcam_visualization, GRADCAM_SHOW_THRESHOLD
 
 # =======================
 # FRAME PREDICTION
 # =======================
 
+# Face pHash -> score entries kept per video (least recently used evicted
+# first), so repeated faces (static scenes) skip the model. Never shared across videos: a similar face from
+# another upload must not lend it its score.
+SCORE_CACHE_SIZE = 1024
+
+
+def crop_face(frame, box):
+    """Crop a detected (x, y, w, h) face from a BGR frame as RGB"""
+    x, y, w, h = box
+    face = frame[y:y+h, x:x+w]
+    return cv2.cvtColor(face, cv2.COLOR_BGR2RGB)
+
+
+def face_phash(face):
+    """64-bit DCT perceptual hash of an RGB face crop"""
+    gray = cv2.cvtColor(face, cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA)
+    low_freq = cv2.dct(np.float32(small))[:8, :8]
+    bits = (low_freq > np.median(low_freq)).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def detect_and_crop(frames):
+    """
+    Detect the largest face in each frame and crop it
+
+    Args:
+        frames: List of video frames (BGR numpy arrays)
+
+    Returns:
+        list: RGB face crop per frame, None where no face was found
+    """
+    try:
+        boxes = detect_faces(frames)
+    except Exception as e:
+        print(f"Error detecting faces: {e}")
+        return [None] * len(frames)
+
+    faces = []
+    for frame, box in zip(frames, boxes):
+        face = None
+        if box is not None:
+            # A bad box or crop only loses this frame, like a frame with no face
+            try:
+                face = crop_face(frame, box)
+            except Exception as e:
+                print(f"Error cropping face: {e}")
+        faces.append(face)
+
+    return faces
+
+
+def score_faces(model, faces, score_cache=None):
+    """
+    Predict deepfake probability for a batch of face crops in one forward pass
+
+    Args:
+        model: Trained model
+        faces: List of RGB face crops (None entries are passed through)
+        score_cache: OrderedDict of face pHash -> score for the current
+                     video, kept in LRU order and updated in place
+                     (None: no caching across calls)
+
+    Returns:
+        list: One score per entry, None where there was no face
+    """
+    scores = [None] * len(faces)
+
+    # Map each batch row back to the entries it was built from; faces
+    # that hash to the same key share one row
+    batch_idx_to_entries = []
+    key_to_batch_idx = {}
+    batch_faces = []
+
+    for i, face in enumerate(faces):
+        if face is None:
+            continue
+
+        key = face_phash(face)
+
+        if score_cache is not None and key in score_cache:
+            score_cache.move_to_end(key)
+            scores[i] = score_cache[key]
+            continue
+
+        if key in key_to_batch_idx:
+            batch_idx_to_entries[key_to_batch_idx[key]].append(i)
+            continue
+
+        key_to_batch_idx[key] = len(batch_faces)
+        batch_idx_to_entries.append([i])
+        batch_faces.append(face)
+
+    if not batch_faces:
+        return scores
+
+    try:
+        batch = transform(batch_faces)
+
+        with torch.inference_mode(), inference_autocast():
+            output = model(batch)
+            batch_scores = torch.sigmoid(output.float()).squeeze(1).tolist()
+
+        for key, batch_idx in key_to_batch_idx.items():
+            score = batch_scores[batch_idx]
+            if score_cache is not None:
+                if len(score_cache) >= SCORE_CACHE_SIZE:
+                    score_cache.popitem(last=False)  # least recently used
+                score_cache[key] = score
+            for i in batch_idx_to_entries[batch_idx]:
+                scores[i] = score
+    except Exception as e:
+        print(f"Error predicting frames: {e}")
+
+    return scores
+
+
+def predict_frames(model, frames):
+    """
+    Predict deepfake probability for a batch of frames in one forward pass
+
+    Args:
+        model: Trained model
+        frames: List of video frames (BGR numpy arrays)
+
+    Returns:
+        list: One score per frame, None where no face was found
+    """
+    return score_faces(model, detect_and_crop(frames))
+
+
 def predict_frame(model, frame):
     """Predict deepfake probability for a single frame"""
-    try:
-        if frame is None or frame.size == 0:
-            return None
-            
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, 1.1, 4)
-
-        if len(faces) == 0:
-            return None
-
-        # Get largest face
-        x, y, w, h = max(faces, key=lambda b: b[2]*b[3])
-        
-        # Validate face coordinates
-        if w <= 0 or h <= 0:
-            return None
-            
-        face = frame[y:y+h, x:x+w]
+    return predict_frames(model, [frame])[0]
+
+# =======================
+# DECODE / DETECT PIPELINE
+# =======================
+
+# Bounded hand-off queues between pipeline stages (caps frames held in memory)
+PIPELINE_QUEUE_SIZE = 32
+_PIPELINE_DONE = object()
+
+
+def iter_frame_samples(cap, stride=1, frame_number=0):
+    """
+    Yield sampled frames from a capture
+
+    After each sampled frame, stride - 1 frames are skipped with grab(),
+    which decodes without converting to an array.
+
+    Args:
+        cap: Capture to read from
+        stride: Sampling stride
+        frame_number: Number of frames already read from cap
+
+    Yields:
+        (frame_number, frame, step) where step is how many frames the
+        sample stands for
+    """
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            return
+        frame_number += 1
+
+        yield frame_number, frame, stride
+
+        skipped = 0
+        while skipped < stride - 1 and cap.grab():
+            skipped += 1
+        frame_number += skipped
+        if skipped < stride - 1:
+            return
+
+
+def _put(q, item, stop):
+    """Blocking put that gives up once the pipeline is stopped"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
 
-        face = Image.fromarray(cv2.cvtColor(face, cv2.COLOR_BGR2RGB))
-        tensor = transform(face).unsqueeze(0).to(DEVICE)
 
-        with torch.no_grad():
-            output = model(tensor)
-            score = torch.sigmoid(output).item()
+def _get(q, stop):
+    """Blocking get that returns _PIPELINE_DONE once the pipeline is stopped"""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _PIPELINE_DONE
 
-        return score
+
+def _run_stage(target, stop, errors):
+    """Run a pipeline stage, recording its exception for the consumer"""
+    try:
+        target()
     except Exception as e:
-        print(f"Error predicting frame: {e}")
-        return None
+        errors.append(e)
+        stop.set()
+
+
+def iter_face_batches(cap, stride=1, batch_size=BATCH_SIZE, frame_number=0):
+    """
+    Decode, detect and crop on background threads; yield batches to score
+
+    Stages run concurrently so the caller's GPU inference on batch N overlaps
+    with decoding and face detection of the following frames:
+    decoder thread -> frame queue -> detector thread -> crop queue -> caller.
+    Order is preserved end to end. frame_number is the number of frames
+    already read from cap.
+
+    The decoder runs up to a batch plus both queues ahead of the caller, so
+    the stride is fixed per call; to change it, close the generator, seek
+    cap to the frame to resume from (CAP_PROP_POS_FRAMES) and start a new one.
+
+    Yields:
+        list of (frame_number, frame, step, face) with face None if no face
+    """
+    frame_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    crop_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    stop = threading.Event()
+    errors = []
+
+    def decode():
+        for sample in iter_frame_samples(cap, stride, frame_number):
+            if not _put(frame_q, sample, stop):
+                return
+        _put(frame_q, _PIPELINE_DONE, stop)
+
+    def detect():
+        done = False
+        while not done:
+            samples = []
+            while len(samples) < batch_size:
+                sample = _get(frame_q, stop)
+                if sample is _PIPELINE_DONE:
+                    done = True
+                    break
+                samples.append(sample)
+
+            faces = detect_and_crop([frame for _, frame, _ in samples])
+            for (frame_number, frame, step), face in zip(samples, faces):
+                if not _put(crop_q, (frame_number, frame, step, face), stop):
+                    return
+        _put(crop_q, _PIPELINE_DONE, stop)
+
+    threads = [
+        threading.Thread(target=_run_stage, args=(stage, stop, errors), daemon=True)
+        for stage in (decode, detect)
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        batch = []
+        while True:
+            item = _get(crop_q, stop)
+            if item is _PIPELINE_DONE:
+                break
+            batch.append(item)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+
+        if errors:
+            raise errors[0]
+        if batch:
+            yield batch
+    finally:
+        # Also runs when the caller stops early (e.g. FAKE verdict reached)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def process_video_threads(path, callback, out_path, prefetch=8):
+    """
+    Apply a per-frame callback to a video and write the result to a file
+
+    Three stages overlap: a reader thread decodes frames, the calling
+    thread runs callback (e.g. Grad-CAM on the GPU) and a writer thread
+    encodes the output, connected by bounded queues of `prefetch` frames.
+
+    Args:
+        path: Path to input video file
+        callback: Function mapping a BGR frame to the BGR frame to write
+                  (same size as the input)
+        out_path: Path of the output video (mp4v)
+        prefetch: Frames buffered between stages
+
+    Returns:
+        int: Number of frames written
+    """
+    cap = open_video(path)
+
+    if not cap.isOpened():
+        raise ValueError(f"Failed to open video: {path}")
+
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    read_q = queue.Queue(maxsize=prefetch)
+    write_q = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    errors = []
+    written = 0
+
+    def read():
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if not _put(read_q, frame, stop):
+                return
+        _put(read_q, _PIPELINE_DONE, stop)
+
+    def write():
+        nonlocal written
+        writer = None
+        try:
+            while True:
+                frame = _get(write_q, stop)
+                if frame is _PIPELINE_DONE:
+                    return
+                if writer is None:
+                    height, width = frame.shape[:2]
+                    writer = cv2.VideoWriter(
+                        out_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height)
+                    )
+                    if not writer.isOpened():
+                        raise ValueError(f"Failed to open video writer: {out_path}")
+                writer.write(frame)
+                written += 1
+        finally:
+            if writer is not None:
+                writer.release()
+
+    threads = [
+        threading.Thread(target=_run_stage, args=(stage, stop, errors), daemon=True)
+        for stage in (read, write)
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            frame = _get(read_q, stop)
+            if frame is _PIPELINE_DONE:
+                break
+            if not _put(write_q, callback(frame), stop):
+                break
+        _put(write_q, _PIPELINE_DONE, stop)
+
+        # Let the writer drain and finalize the file
+        threads[1].join()
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        cap.release()
+
+    if errors:
+        raise errors[0]
+
+    return written
+
+def encode_jpeg_base64(vis_frame, quality=85):
+    """Encode an RGB visualization frame as a base64 JPEG string"""
+    ok, encoded = cv2.imencode(
+        '.jpg',
+        cvt_color_buffered(vis_frame, cv2.COLOR_RGB2BGR),
+        [cv2.IMWRITE_JPEG_QUALITY, quality]
+    )
+    if not ok:
+        raise ValueError("Failed to encode visualization frame")
+    return base64.b64encode(encoded.tobytes()).decode('ascii')
+
+def render_gradcam_frames(model, candidates):
+    """
+    Run Grad-CAM on buffered frames and encode the visualizations
+
+    Args:
+        model: Trained model
+        candidates: List of (frame_number, frame, score, is_detection_frame),
+                    already filtered on score by the caller
+
+    Returns:
+        list: Visualization dicts for the frames where a face was found
+    """
+    gradcam_frames = []
+    if not candidates:
+        return gradcam_frames
+
+    # One batched Grad-CAM pass over all buffered frames
+    gradcam_results = analyze_frames_batch(
+        model, [frame for _, frame, _, _ in candidates], None, transform, DEVICE
+    )
+
+    for (frame_count, frame, _, is_detection_frame), gradcam_result in zip(candidates, gradcam_results):
+        if gradcam_result is None:
+            continue
+
+        # Create visualization
+        vis_frame = create_gradcam_visualization(frame, gradcam_result)
+
+        # Convert to base64 for sending to frontend
+        img_str = encode_jpeg_base64(vis_frame)
+
+        entry = {
+            'frame_number': frame_count,
+            'score': float(gradcam_result['score']),
+            'image': f"data:image/jpeg;base64,{img_str}"
+        }
+        if is_detection_frame:
+            entry['detection_frame'] = True
+        gradcam_frames.append(entry)
+
+    return gradcam_frames
 
 # =======================
 # VIDEO ANALYSIS WITH GRAD-CAM
@@ -89,8 +536,18 @@ def analyze_video_with_gradcam(model, path, generate_visualization=True):
     EMA_ALPHA = 0.15
     CONSECUTIVE_FRAMES = 5
     FAKE_THRESHOLD = 0.70
+    SUSPICIOUS_THRESHOLD = 0.55
+
+    # Score every FRAME_STRIDE-th frame while the video looks real and every
+    # frame while the EMA is suspicious. The pipeline decodes ahead of the
+    # scores, so a stride change restarts it right after the current sample
+    # (seeking back; frames it skipped are re-read)
+    FRAME_STRIDE = 3
+
+    # Heatmaps shown, one slot always kept for the detection frame
+    MAX_GRADCAM_FRAMES = 5
 
-    cap = cv2.VideoCapture(path)
+    cap = open_video(path)
     
     if not cap.isOpened():
         raise ValueError(f"Failed to open video: {path}")
@@ -99,90 +556,106 @@ def analyze_video_with_gradcam(model, path, generate_visualization=True):
     hits = 0
     is_fake = False
     first = True
-    frame_count = 0
     processed_count = 0
-    gradcam_frames = []
+    candidates = []
+    score_cache = OrderedDict()
+    stride = FRAME_STRIDE
+    resume_at = 0
     
     # Sample frames for Grad-CAM visualization (every Nth frame)
     visualization_interval = 10 if generate_visualization else float('inf')
 
     try:
-        while True:
-            ret, frame = cap.read()
-            if not ret:
+        while resume_at is not None:
+            start_frame, resume_at = resume_at, None
+            if start_frame and not cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame):
                 break
+            
+            batches = iter_face_batches(
+                cap, stride=stride, frame_number=start_frame
+            )
+            try:
+                for batch in batches:
+                    scores = score_faces(
+                        model, [face for _, _, _, face in batch], score_cache
+                    )
 
-            frame_count += 1
-            score = predict_frame(model, frame)
+                    for (frame_count, frame, step, _), score in zip(batch, scores):
+                        if score is None:
+                            continue
 
-            if score is None:
-                continue
+                        processed_count += 1
+                        previous_ema = None if first else ema_score
+                        
+                        if first:
+                            ema_score = score
+                            first = False
+                        else:
+                            # EMA per sample, scaled so the time constant in
+                            # frames does not depend on the stride
+                            alpha = 1 - (1 - EMA_ALPHA) ** step
+                            ema_score = alpha * score + (1 - alpha) * ema_score
 
-            processed_count += 1
-            
-            if first:
-                ema_score = score
-                first = False
-            else:
-                ema_score = EMA_ALPHA * score + (1-EMA_ALPHA) * ema_score
-
-            # Generate Grad-CAM visualization for sampled frames
-            if generate_visualization and frame_count % visualization_interval == 0 and len(gradcam_frames) < 5:
-                gradcam_result = analyze_frame_with_gradcam(
-                    model, frame, face_cascade, transform, DEVICE
-                )
-                
-                if gradcam_result is not None:
-                    # Create visualization
-                    vis_frame = create_gradcam_visualization(frame, gradcam_result)
-                    
-                    # Convert to base64 for sending to frontend
-                    pil_img = Image.fromarray(vis_frame)
-                    buffer = BytesIO()
-                    pil_img.save(buffer, format='JPEG', quality=85)
-                    img_str = base64.b64encode(buffer.getvalue()).decode()
-                    
-                    gradcam_frames.append({
-                        'frame_number': frame_count,
-                        'score': float(gradcam_result['score']),
-                        'image': f"data:image/jpeg;base64,{img_str}"
-                    })
-
-            if ema_score > FAKE_THRESHOLD:
-                hits += 1
-            else:
-                hits = 0
-
-            if hits >= CONSECUTIVE_FRAMES:
-                is_fake = True
-                # Generate one final Grad-CAM for the detection frame
-                if generate_visualization and len(gradcam_frames) < 5:
-                    gradcam_result = analyze_frame_with_gradcam(
-                        model, frame, face_cascade, transform, DEVICE
-                    )
-                    if gradcam_result is not None:
-                        vis_frame = create_gradcam_visualization(frame, gradcam_result)
-                        pil_img = Image.fromarray(vis_frame)
-                        buffer = BytesIO()
-                        pil_img.save(buffer, format='JPEG', quality=85)
-                        img_str = base64.b64encode(buffer.getvalue()).decode()
-                        gradcam_frames.append({
-                            'frame_number': frame_count,
-                            'score': float(gradcam_result['score']),
-                            'image': f"data:image/jpeg;base64,{img_str}",
-                            'detection_frame': True
-                        })
-                break
+                        if step > 1 and ema_score > SUSPICIOUS_THRESHOLD:
+                            # Confirm frame by frame: the sample only stands
+                            # for its own frame, the ones it skipped are re-read
+                            step = 1
+                            if previous_ema is not None:
+                                ema_score = EMA_ALPHA * score + (1 - EMA_ALPHA) * previous_ema
+                            resume_at = frame_count
+
+                        # Remember sampled frames that look fake for Grad-CAM;
+                        # heatmaps are only computed after the verdict (the
+                        # sample covers frames frame_count .. frame_count + step - 1)
+                        crosses_interval = (
+                            (frame_count + step - 1) // visualization_interval
+                            > (frame_count - 1) // visualization_interval
+                        )
+                        if (generate_visualization and crosses_interval
+                                and score > GRADCAM_SHOW_THRESHOLD
+                                and len(candidates) < MAX_GRADCAM_FRAMES - 1):
+                            candidates.append((frame_count, frame, score, False))
+
+                        # Only frame-by-frame samples count towards the verdict
+                        if step == 1 and ema_score > FAKE_THRESHOLD:
+                            hits += 1
+                        else:
+                            hits = 0
+
+                        if hits >= CONSECUTIVE_FRAMES:
+                            is_fake = True
+                            # Keep the detection frame for a final Grad-CAM
+                            if generate_visualization:
+                                candidates.append((frame_count, frame, score, True))
+                            break
+
+                        wanted_stride = 1 if ema_score > SUSPICIOUS_THRESHOLD else FRAME_STRIDE
+                        if wanted_stride != stride:
+                            resume_at = frame_count
+                        if resume_at is not None:
+                            stride = wanted_stride
+                            break
+
+                    if is_fake or resume_at is not None:
+                        break
+            finally:
+                batches.close()
     finally:
         cap.release()
     
     # Return result based on analysis
     if processed_count == 0:
         raise ValueError("No faces detected in video")
-    
+
+    # Heatmaps are only shown for FAKE / SUSPICIOUS verdicts, so REAL
+    # videos skip the Grad-CAM forward + backward passes entirely
+    gradcam_frames = []
+    if is_fake or ema_score > SUSPICIOUS_THRESHOLD:
+        gradcam_frames = render_gradcam_frames(model, candidates)
+
     if is_fake:
         return "FAKE", float(ema_score), gradcam_frames
-    elif ema_score > 0.55:
+    elif ema_score > SUSPICIOUS_THRESHOLD:
         return "SUSPICIOUS", float(ema_score), gradcam_frames
     else:
         return "REAL", float(ema_score), gradcam_frames
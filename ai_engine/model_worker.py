@@ -0,0 +1,163 @@
+"""
+Model Worker
+Runs video analysis in a dedicated process that owns the model and its
+CUDA context, so the API process only handles I/O
+"""
+
+import multiprocessing as mp
+import itertools
+import threading
+import queue
+import logging
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+_READY = "ready"
+_SHUTDOWN = None
+
+# How often start() checks that the worker is still alive while it loads
+_START_POLL_INTERVAL = 1.0  # seconds
+
+
+def _worker_main(in_q, out_q):
+    """Worker process entry point: load the model once, then serve jobs"""
+    # Imported here so the API process never initializes torch / CUDA
+    from model_loader import load_model
+    from inference import analyze_video_with_gradcam
+
+    try:
+        model = load_model()
+    except Exception as e:
+        out_q.put((None, False, f"Failed to load model: {e}"))
+        return
+
+    out_q.put((None, True, _READY))
+
+    while True:
+        job = in_q.get()
+        if job is _SHUTDOWN:
+            break
+
+        job_id, path, generate_visualization = job
+        try:
+            result = analyze_video_with_gradcam(
+                model, path, generate_visualization=generate_visualization
+            )
+            out_q.put((job_id, True, result))
+        except Exception as e:
+            out_q.put((job_id, False, str(e)))
+
+
+class ModelWorker:
+    """
+    Handle to the model worker process
+
+    Jobs are sent over a multiprocessing queue; a collector thread resolves
+    the matching future when the worker replies.
+    """
+    def __init__(self):
+        ctx = mp.get_context("spawn")  # CUDA cannot be forked
+        self.in_q = ctx.Queue()
+        self.out_q = ctx.Queue()
+        self.process = ctx.Process(
+            target=_worker_main, args=(self.in_q, self.out_q), daemon=True
+        )
+        self._job_ids = itertools.count()
+        self._pending = {}
+        self._closed = False  # set once the collector has failed all pending jobs
+        self._lock = threading.Lock()
+        self._collector = None
+
+    def start(self):
+        """Start the worker and block until the model is loaded"""
+        self.process.start()
+
+        while True:
+            # Checked before waiting: anything a dead worker sent (e.g. its
+            # load error) is already in the queue
+            alive = self.process.is_alive()
+            try:
+                _, ok, message = self.out_q.get(timeout=_START_POLL_INTERVAL)
+                break
+            except queue.Empty:
+                if not alive:
+                    raise RuntimeError(
+                        f"Model worker exited during startup "
+                        f"(exit code {self.process.exitcode})"
+                    )
+
+        if not ok:
+            self.process.join()
+            raise RuntimeError(message)
+
+        self._collector = threading.Thread(
+            target=self._collect_results, name="model-worker-results", daemon=True
+        )
+        self._collector.start()
+        logger.info(f"Model worker started (PID: {self.process.pid})")
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def submit(self, path, generate_visualization=True):
+        """
+        Analyze a video in the worker (blocking)
+
+        Args:
+            path: Path to video file (readable by the worker process)
+            generate_visualization: Whether to generate Grad-CAM heatmaps
+
+        Returns:
+            tuple: (prediction, score, gradcam_frames), as analyze_video_with_gradcam
+        """
+        future = Future()
+        with self._lock:
+            # Once the collector has exited nothing would resolve the future
+            if self._closed:
+                raise RuntimeError("Model worker is not running")
+            job_id = next(self._job_ids)
+            self._pending[job_id] = future
+
+        # Checked after registering: if the worker dies from here on, the
+        # collector fails the future
+        if not self.is_alive():
+            with self._lock:
+                self._pending.pop(job_id, None)
+            raise RuntimeError("Model worker is not running")
+
+        self.in_q.put((job_id, path, generate_visualization))
+        return future.result()
+
+    def _collect_results(self):
+        while True:
+            try:
+                job_id, ok, result = self.out_q.get(timeout=1.0)
+            except queue.Empty:
+                if not self.is_alive():
+                    self._fail_pending(RuntimeError("Model worker exited"))
+                    return
+                continue
+
+            with self._lock:
+                future = self._pending.pop(job_id, None)
+            if future is None:
+                continue
+
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(result))
+
+    def _fail_pending(self, error):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._closed = True
+        for future in pending.values():
+            future.set_exception(error)
+
+    def stop(self):
+        """Ask the worker to exit and wait for it"""
+        if self.is_alive():
+            self.in_q.put(_SHUTDOWN)
+            self.process.join(timeout=10)
@@ -4,30 +4,151 @@ Generates unique SHA-256 hash for video files for deduplication
 """
 
 import hashlib
+import mmap
 import os
+import ssl
+import logging
+import string
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+
+# Chunk size for streaming reads / uploads
+HASH_CHUNK_SIZE = 1024 * 1024  # 1MB
+
+# Buffer size for the readinto fallback when a file cannot be mmapped
+HASH_READ_BUFFER_SIZE = 4 * 1024 * 1024  # 4MB
+
+
+@dataclass(frozen=True)
+class FileDigest:
+    """
+    Hash of an uploaded video, computed once and passed to every stage
+    (dedup lookup, database record, blockchain evidence)
+    
+    Attributes:
+        hex: 64-character lowercase hexadecimal digest
+        size: File size in bytes
+    """
+    hex: str
+    size: int
+    
+    def __post_init__(self):
+        if len(self.hex) != 64 or not set(self.hex) <= set(string.hexdigits.lower()):
+            raise ValueError(f"Invalid SHA-256 hex digest: {self.hex!r}")
+        if self.size < 0:
+            raise ValueError(f"Invalid file size: {self.size}")
+
+
+def _cpu_has_sha_ni():
+    """Check /proc/cpuinfo for the x86 SHA extensions (Linux only)"""
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    return "sha_ni" in line.split()
+    except OSError:
+        pass
+    return False
+
+
+SHA_NI_AVAILABLE = _cpu_has_sha_ni()
+
+if SHA_NI_AVAILABLE:
+    logger.info(f"SHA-NI available, hashing via {ssl.OPENSSL_VERSION}")
+else:
+    logger.info("SHA-NI not detected, using scalar SHA-256")
+
+
+def new_video_hasher():
+    """
+    Create an incremental video hasher
+    
+    SHA-256 is kept because stored analyses and on-chain evidence are keyed
+    by it. hashlib.new() goes through OpenSSL's EVP interface, which picks
+    the SHA-NI (SHA256RNDS2 / SHA256MSG1 / SHA256MSG2) kernel at runtime
+    when the CPU supports it.
+    
+    Returns:
+        hashlib hash object supporting update() / hexdigest()
+    """
+    return hashlib.new("sha256")
+
+
+def compute_video_hash_stream(file_obj):
+    """
+    Compute SHA-256 hash by streaming a binary file object
+    
+    Args:
+        file_obj: File object opened in binary mode
+        
+    Returns:
+        str: 64-character hexadecimal hash
+    """
+    sha256_hash = new_video_hasher()
+    for byte_block in iter(lambda: file_obj.read(HASH_CHUNK_SIZE), b""):
+        sha256_hash.update(byte_block)
+    return sha256_hash.hexdigest()
+
+
+def _hash_file_readinto(f, sha256_hash):
+    """Feed a file to the hasher through one reusable buffer"""
+    buffer = bytearray(HASH_READ_BUFFER_SIZE)
+    view = memoryview(buffer)
+    while True:
+        n = f.readinto(buffer)
+        if not n:
+            break
+        sha256_hash.update(view[:n])
 
 
 def compute_video_hash(file_path):
     """
     Compute SHA-256 hash of video file
     
+    The file is memory-mapped and handed to the hasher in one update()
+    call, so OpenSSL streams over the page cache without Python-side
+    copies. Empty files and platforms without mmap fall back to readinto
+    on a 4MB buffer.
+    
     Args:
         file_path: Path to video file
         
     Returns:
         str: 64-character hexadecimal hash
     """
-    sha256_hash = hashlib.sha256()
+    sha256_hash = new_video_hasher()
     
-    # Read file in chunks to handle large videos
     with open(file_path, "rb") as f:
-        # Read in 64kb chunks
-        for byte_block in iter(lambda: f.read(65536), b""):
-            sha256_hash.update(byte_block)
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # Empty file, or a file object mmap cannot map
+            _hash_file_readinto(f, sha256_hash)
+            return sha256_hash.hexdigest()
+        
+        with mm:
+            if hasattr(mm, "madvise"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            sha256_hash.update(mm)
     
     return sha256_hash.hexdigest()
 
 
+def compute_file_digest(file_path):
+    """
+    Hash a video file for its identity (SHA-256, at any size)
+    
+    Args:
+        file_path: Path to video file
+        
+    Returns:
+        FileDigest
+    """
+    return FileDigest(compute_video_hash(file_path), get_file_size(file_path))
+
+
 def compute_video_hash_from_bytes(file_bytes):
     """
     Compute SHA-256 hash from file bytes (for uploaded files)
@@ -38,7 +159,7 @@ def compute_video_hash_from_bytes(file_bytes):
     Returns:
         str: 64-character hexadecimal hash
     """
-    sha256_hash = hashlib.sha256()
+    sha256_hash = new_video_hasher()
     sha256_hash.update(file_bytes)
     return sha256_hash.hexdigest()
 
@@ -55,12 +176,17 @@ if __name__ == "__main__":
     if len(sys.argv) > 1:
         test_file = sys.argv[1]
         if os.path.exists(test_file):
-            video_hash = compute_video_hash(test_file)
-            file_size = get_file_size(test_file)
+            digest = compute_file_digest(test_file)
+            
+            # The streamed upload path must agree with the file-based one
+            with open(test_file, "rb") as f:
+                streamed = compute_video_hash_stream(f)
+            assert digest.hex == streamed, "streamed and mmap hashes differ"
             
             print(f"File: {test_file}")
-            print(f"Size: {file_size:,} bytes ({file_size / (1024*1024):.2f} MB)")
-            print(f"Hash: {video_hash}")
+            print(f"Size: {digest.size:,} bytes ({digest.size / (1024*1024):.2f} MB)")
+            print(f"Hash: {digest.hex}")
+            print(f"SHA-NI: {'yes' if SHA_NI_AVAILABLE else 'no'}")
         else:
             print(f"File not found: {test_file}")
     else:
@@ -0,0 +1,183 @@
+"""
+Video Reader
+Decodes video frames through PyAV (FFmpeg, NVDEC when available) with
+cv2.VideoCapture as fallback
+"""
+
+import cv2
+import torch
+import logging
+
+try:
+    import av
+    from av.codec.hwaccel import HWAccel, hwdevices_available
+except ImportError:
+    av = None
+
+logger = logging.getLogger(__name__)
+
+# Display-matrix rotation (degrees counterclockwise) -> cv2.rotate code
+_ROTATE_CODES = {
+    90: cv2.ROTATE_90_COUNTERCLOCKWISE,
+    -90: cv2.ROTATE_90_CLOCKWISE,
+    180: cv2.ROTATE_180,
+    -180: cv2.ROTATE_180,
+}
+
+
+class PyAVCapture:
+    """
+    cv2.VideoCapture-compatible reader backed by PyAV
+
+    Decoding runs with FFmpeg frame threading and, on CUDA hosts, NVDEC
+    hardware acceleration (falling back to software decode per stream).
+    Like cv2.VideoCapture, frames are returned upright: the display matrix
+    rotation (portrait phone videos) is applied, and get() reports the
+    rotated frame size. set(CAP_PROP_POS_FRAMES) seeks frame-accurately to
+    any frame already decoded, using its recorded timestamp.
+    """
+    def __init__(self, path):
+        self.container = None
+        self._frames = None
+        self._peeked = None
+        self._position = 0  # index of the next frame read() / grab() returns
+        self._frame_pts = []  # pts per frame index, for seeking back
+
+        hwaccel = self._hwaccel()
+        try:
+            self.container = av.open(path, hwaccel=hwaccel) if hwaccel else av.open(path)
+        except av.error.FFmpegError as e:
+            if hwaccel is None:
+                raise
+            logger.warning(f"Hardware decode unavailable, using software decode: {e}")
+            self.container = av.open(path)
+
+        stream = self.container.streams.video[0]
+        stream.thread_type = "AUTO"
+        self._frames = self.container.decode(stream)
+
+        # The rotation is only exposed on decoded frames; peek at the first
+        self._peeked = self._next()
+        self.rotation = self._peeked.rotation if self._peeked is not None else 0
+
+    @staticmethod
+    def _hwaccel():
+        if torch.cuda.is_available() and "cuda" in hwdevices_available():
+            return HWAccel(device_type="cuda", allow_software_fallback=True)
+        return None
+
+    def get(self, prop):
+        """Subset of cv2.VideoCapture.get: FPS, frame width / height"""
+        stream = self.container.streams.video[0]
+        if prop == cv2.CAP_PROP_FPS:
+            return float(stream.average_rate or 0)
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self._position)
+        width, height = stream.codec_context.width, stream.codec_context.height
+        if self.rotation in (90, -90):
+            width, height = height, width
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(height)
+        return 0.0
+
+    def set(self, prop, value):
+        """
+        Subset of cv2.VideoCapture.set: CAP_PROP_POS_FRAMES
+
+        Seeking back to a frame that was already decoded goes to the keyframe
+        before its timestamp and decodes forward to it; other positions are
+        reached by decoding forward (from the start, if behind).
+        """
+        if prop != cv2.CAP_PROP_POS_FRAMES:
+            return False
+
+        frame_number = int(value)
+        stream = self.container.streams.video[0]
+        target = self._frame_pts[frame_number] if frame_number < len(self._frame_pts) else None
+
+        if target is not None:
+            self.container.seek(target, stream=stream, backward=True)
+            self._frames = self.container.decode(stream)
+            self._peeked = None
+            while True:
+                frame = self._next()
+                if frame is None:
+                    return False
+                if frame.pts is not None and frame.pts >= target:
+                    self._peeked = frame
+                    self._position = frame_number
+                    return True
+
+        if frame_number < self._position:
+            self.container.seek(0, stream=stream)
+            self._frames = self.container.decode(stream)
+            self._peeked = None
+            self._position = 0
+
+        while self._position < frame_number:
+            if not self.grab():
+                return False
+        return True
+
+    def isOpened(self):
+        return self.container is not None
+
+    def grab(self):
+        """Decode the next frame without converting it to an array"""
+        return self._advance() is not None
+
+    def read(self):
+        """Decode the next frame as a BGR numpy array"""
+        frame = self._advance()
+        if frame is None:
+            return False, None
+
+        image = frame.to_ndarray(format='bgr24')
+        code = _ROTATE_CODES.get(frame.rotation)
+        if code is not None:
+            image = cv2.rotate(image, code)
+        return True, image
+
+    def _advance(self):
+        """Next frame for the caller, recording its position and pts"""
+        frame = self._next()
+        if frame is not None:
+            if self._position == len(self._frame_pts):
+                self._frame_pts.append(frame.pts)
+            self._position += 1
+        return frame
+
+    def _next(self):
+        if self._peeked is not None:
+            frame, self._peeked = self._peeked, None
+            return frame
+        try:
+            return next(self._frames)
+        except (StopIteration, av.error.FFmpegError):
+            return None
+
+    def release(self):
+        if self.container is not None:
+            self.container.close()
+            self.container = None
+
+
+def open_video(path):
+    """
+    Open a video for frame-by-frame decoding
+
+    Args:
+        path: Path to video file
+
+    Returns:
+        Capture object exposing isOpened() / read() / grab() / get() / release()
+    """
+    if av is not None:
+        try:
+            return PyAVCapture(path)
+        except Exception as e:
+            logger.warning(f"PyAV failed to open video, using OpenCV: {e}")
+
+    return cv2.VideoCapture(path)
@@ -5,12 +5,88 @@ Handles logging evidence to Polygon blockchain
 
 import os
 import json
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from web3 import Web3
+from eth_abi import encode
+from eth_utils import function_signature_to_4byte_selector
+from eth_utils.abi import collapse_if_tuple
 from dotenv import load_dotenv
 from datetime import datetime
 
 load_dotenv()
 
+# How long a fetched gas price is reused for subsequent transactions
+GAS_PRICE_TTL = 15  # seconds
+
+# RPC HTTP connection pool
+RPC_POOL_CONNECTIONS = 4
+RPC_POOL_MAXSIZE = 16
+RPC_TIMEOUT = 10  # seconds
+
+# Gas limit for logEvidence transactions
+LOG_EVIDENCE_GAS = 500000
+
+
+def _function_abi(abi, name):
+    """ABI entry of the contract function `name`, or None"""
+    for entry in abi or ():
+        if entry.get('type') == 'function' and entry.get('name') == name:
+            return entry
+    return None
+
+
+# Contract ABI is parsed once; logEvidence calldata is encoded directly from
+# its input types instead of going through web3 contract function objects
+_abi_string = os.getenv('CONTRACT_ABI')
+CONTRACT_ABI = json.loads(_abi_string) if _abi_string else None
+
+_log_evidence_abi = _function_abi(CONTRACT_ABI, 'logEvidence')
+if _log_evidence_abi is not None:
+    LOG_EVIDENCE_TYPES = [collapse_if_tuple(i) for i in _log_evidence_abi['inputs']]
+    LOG_EVIDENCE_SELECTOR = function_signature_to_4byte_selector(
+        f"logEvidence({','.join(LOG_EVIDENCE_TYPES)})"
+    )
+else:
+    LOG_EVIDENCE_TYPES = None
+    LOG_EVIDENCE_SELECTOR = None
+
+
+def _encode_log_evidence(video_hash, is_fake, confidence):
+    """
+    Calldata for logEvidence(video_hash, is_fake, confidence)
+    
+    A bytesN video_hash parameter takes the raw digest; a string one takes
+    the hex digest as is.
+    """
+    args = [video_hash, is_fake, confidence]
+    for i, abi_type in enumerate(LOG_EVIDENCE_TYPES):
+        if abi_type.startswith('bytes') and isinstance(args[i], str):
+            args[i] = bytes.fromhex(args[i].removeprefix('0x'))
+    return LOG_EVIDENCE_SELECTOR + encode(LOG_EVIDENCE_TYPES, args)
+
+
+def _rpc_session():
+    """
+    requests.Session with a keep-alive connection pool for the RPC endpoint
+    
+    Reusing connections avoids a TCP + TLS handshake per JSON-RPC call.
+    Connection failures are retried with backoff; requests already sends
+    Accept-Encoding: gzip, deflate.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=RPC_POOL_CONNECTIONS,
+        pool_maxsize=RPC_POOL_MAXSIZE,
+        max_retries=Retry(total=3, backoff_factor=0.2)
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
 
 class BlockchainService:
     """
@@ -24,12 +100,15 @@ class BlockchainService:
         self.private_key = os.getenv('PRIVATE_KEY')
         self.contract_address = os.getenv('CONTRACT_ADDRESS')
         
-        # Load contract ABI
-        abi_string = os.getenv('CONTRACT_ABI')
-        self.contract_abi = json.loads(abi_string) if abi_string else None
+        # Contract ABI (parsed at import)
+        self.contract_abi = CONTRACT_ABI
         
         # Initialize Web3
-        self.w3 = Web3(Web3.HTTPProvider(self.alchemy_url))
+        self.w3 = Web3(Web3.HTTPProvider(
+            self.alchemy_url,
+            session=_rpc_session(),
+            request_kwargs={'timeout': RPC_TIMEOUT}
+        ))
         
         # Initialize contract
         if self.contract_address and self.contract_abi:
@@ -41,11 +120,35 @@ class BlockchainService:
             self.contract = None
             
         self.chain_id = 11155111  # Sepolia testnet (change to 137 for Polygon mainnet)
+        
+        # Gas price is cached briefly and the nonce tracked locally, so a
+        # burst of transactions does not pay two RPC round trips each
+        self._gas_price_cache = (0.0, None)  # (fetched_at, wei)
+        self._nonce = None  # next nonce to use; None = resync from chain
+        self._tx_lock = threading.Lock()
     
     def is_connected(self):
         """Check if connected to blockchain"""
         return self.w3.is_connected()
     
+    def _get_gas_price(self):
+        """Gas price in wei, refreshed at most every GAS_PRICE_TTL seconds"""
+        fetched_at, gas_price = self._gas_price_cache
+        now = time.monotonic()
+        if gas_price is None or now - fetched_at > GAS_PRICE_TTL:
+            gas_price = self.w3.eth.gas_price
+            self._gas_price_cache = (now, gas_price)
+        return gas_price
+    
+    def _next_nonce(self):
+        """Allocate the next nonce (caller holds _tx_lock)"""
+        if self._nonce is None:
+            # 'pending' counts transactions already sent but not yet mined
+            self._nonce = self.w3.eth.get_transaction_count(self.wallet_address, 'pending')
+        nonce = self._nonce
+        self._nonce += 1
+        return nonce
+    
     def log_evidence(self, video_hash, is_fake, confidence):
         """
         Log evidence to blockchain
@@ -60,28 +163,37 @@ class BlockchainService:
         """
         if not self.contract:
             raise ValueError("Contract not initialized. Check .env configuration.")
+        if LOG_EVIDENCE_SELECTOR is None:
+            raise ValueError("Contract ABI has no logEvidence function")
         
         try:
-            # Get current nonce
-            nonce = self.w3.eth.get_transaction_count(self.wallet_address)
-            
-            # Build transaction
-            tx = self.contract.functions.logEvidence(
-                video_hash,
-                is_fake,
-                confidence
-            ).build_transaction({
-                'chainId': self.chain_id,
-                'gas': 500000,
-                'gasPrice': self.w3.eth.gas_price,
-                'nonce': nonce,
-            })
-            
-            # Sign transaction
-            signed_tx = self.w3.eth.account.sign_transaction(tx, self.private_key)
+            # Nonces are handed out and sent in order
+            with self._tx_lock:
+                try:
+                    nonce = self._next_nonce()
+                    
+                    # Build transaction
+                    tx = {
+                        'to': self.contract.address,
+                        'data': _encode_log_evidence(video_hash, is_fake, confidence),
+                        'value': 0,
+                        'chainId': self.chain_id,
+                        'gas': LOG_EVIDENCE_GAS,
+                        'gasPrice': self._get_gas_price(),
+                        'nonce': nonce,
+                    }
+                    
+                    # Sign transaction
+                    signed_tx = self.w3.eth.account.sign_transaction(tx, self.private_key)
+                    
+                    # Send transaction
+                    tx_hash = self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+                except Exception:
+                    # The local nonce may now be ahead of (or behind) the
+                    # chain; resync on the next transaction
+                    self._nonce = None
+                    raise
             
-            # Send transaction
-            tx_hash = self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
             tx_hash_hex = self.w3.to_hex(tx_hash)
             
             # Generate Etherscan URL
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# ai_engine modules import each other by bare name (see app.py)
+AI_ENGINE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "ai_engine")
+if AI_ENGINE_DIR not in sys.path:
+    sys.path.insert(0, AI_ENGINE_DIR)
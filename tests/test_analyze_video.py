@@ -0,0 +1,129 @@
+"""
+analyze_video_with_gradcam against the original per-frame decision logic
+
+Face detection and scoring are replaced by a per-frame score table, so the
+tests exercise the sampling / stride / EMA logic on a real decoded video.
+"""
+
+import hashlib
+
+import cv2
+import numpy as np
+import pytest
+
+import inference
+
+NUM_FRAMES = 300
+
+EMA_ALPHA = 0.15
+CONSECUTIVE_FRAMES = 5
+FAKE_THRESHOLD = 0.70
+SUSPICIOUS_THRESHOLD = 0.55
+
+
+def _frame_key(frame):
+    return hashlib.md5(frame.tobytes()).hexdigest()
+
+
+@pytest.fixture(scope="module")
+def video(tmp_path_factory):
+    """Intra-only test video with a distinct frame per index; returns (path, key -> frame number)"""
+    path = str(tmp_path_factory.mktemp("video") / "test.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 30, (64, 48))
+    rng = np.random.default_rng(0)
+    for _ in range(NUM_FRAMES):
+        writer.write(rng.integers(0, 256, (48, 64, 3), dtype=np.uint8))
+    writer.release()
+
+    cap = inference.open_video(path)
+    frame_numbers = {}
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frame_numbers[_frame_key(frame)] = len(frame_numbers) + 1
+    cap.release()
+
+    assert len(frame_numbers) == NUM_FRAMES
+    return path, frame_numbers
+
+
+@pytest.fixture
+def scored_video(video, monkeypatch):
+    """Run analyze_video_with_gradcam with per-frame scores; returns (result, frames scored)"""
+    path, frame_numbers = video
+
+    def run(frame_scores, generate_visualization=False):
+        scored = []
+
+        def score_faces(model, faces, score_cache=None):
+            numbers = [frame_numbers[_frame_key(face)] for face in faces]
+            scored.extend(numbers)
+            return [frame_scores[n - 1] for n in numbers]
+
+        # The "face" is the whole frame, so its bytes identify the frame number
+        monkeypatch.setattr(inference, "detect_and_crop", lambda frames: list(frames))
+        monkeypatch.setattr(inference, "score_faces", score_faces)
+        result = inference.analyze_video_with_gradcam(None, path, generate_visualization)
+        return result, scored
+
+    return run
+
+
+def per_frame_verdict(frame_scores):
+    """The original analyze_video_with_gradcam decision: every frame, no stride"""
+    ema_score = 0
+    hits = 0
+    for i, score in enumerate(frame_scores):
+        ema_score = score if i == 0 else EMA_ALPHA * score + (1 - EMA_ALPHA) * ema_score
+        hits = hits + 1 if ema_score > FAKE_THRESHOLD else 0
+        if hits >= CONSECUTIVE_FRAMES:
+            return "FAKE", ema_score
+    if ema_score > SUSPICIOUS_THRESHOLD:
+        return "SUSPICIOUS", ema_score
+    return "REAL", ema_score
+
+
+SCORE_CASES = {
+    "real": [0.2] * NUM_FRAMES,
+    "suspicious_first_face": [0.6] + [0.2] * (NUM_FRAMES - 1),
+    "single_spike": [0.99] + [0.24] * (NUM_FRAMES - 1),
+    "late_fake": [0.1] * 150 + [0.95] * 150,
+    "suspicious_middle": [0.2] * 100 + [0.65] * 60 + [0.2] * 140,
+    "borderline_end": [0.2] * 200 + [0.62] * 100,
+}
+
+
+@pytest.mark.parametrize("case", sorted(SCORE_CASES))
+def test_verdict_matches_per_frame_baseline(scored_video, case):
+    frame_scores = SCORE_CASES[case]
+    (prediction, score, _), _ = scored_video(frame_scores)
+
+    expected_prediction, expected_score = per_frame_verdict(frame_scores)
+    assert prediction == expected_prediction
+    assert score == pytest.approx(expected_score, abs=1e-6)
+
+
+def test_stride_returns_after_suspicious_start(scored_video):
+    # Dense scoring only while the EMA is suspicious, then back to the stride
+    (prediction, _, _), scored = scored_video(SCORE_CASES["suspicious_first_face"])
+
+    assert prediction == "REAL"
+    assert len(scored) < NUM_FRAMES // 2
+
+
+def test_late_fake_gets_heatmaps(scored_video, monkeypatch):
+    # The real first half must not use up the Grad-CAM slots
+    monkeypatch.setattr(
+        inference, "analyze_frames_batch",
+        lambda model, frames, *args: [{"score": 1.0} for _ in frames],
+    )
+    monkeypatch.setattr(inference, "create_gradcam_visualization", lambda frame, result: frame)
+    monkeypatch.setattr(inference, "encode_jpeg_base64", lambda image: "")
+
+    (prediction, _, gradcam_frames), _ = scored_video(SCORE_CASES["late_fake"], generate_visualization=True)
+
+    assert prediction == "FAKE"
+    assert gradcam_frames
+    assert all(entry["frame_number"] > 150 for entry in gradcam_frames)
+    assert gradcam_frames[-1].get("detection_frame")
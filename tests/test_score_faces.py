@@ -0,0 +1,40 @@
+"""score_faces per-video cache"""
+
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+import inference
+
+
+class CountingModel:
+    """Stand-in classifier: logit 0 for every face, counting scored faces"""
+    def __init__(self):
+        self.scored = 0
+
+    def __call__(self, batch):
+        self.scored += batch.shape[0]
+        return torch.zeros((batch.shape[0], 1))
+
+
+def _face(seed):
+    return np.random.default_rng(seed).integers(0, 256, (64, 64, 3), dtype=np.uint8)
+
+
+def test_cache_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(inference, "SCORE_CACHE_SIZE", 2)
+    model = CountingModel()
+    cache = OrderedDict()
+    a, b, c = _face(0), _face(1), _face(2)
+
+    inference.score_faces(model, [a, b], cache)
+    inference.score_faces(model, [a], cache)  # hit: a becomes most recent
+    inference.score_faces(model, [c], cache)  # evicts b, not a
+    assert model.scored == 3
+
+    assert inference.score_faces(model, [a], cache) == [0.5]
+    assert model.scored == 3
+
+    inference.score_faces(model, [b], cache)
+    assert model.scored == 4